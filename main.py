@@ -1,26 +1,107 @@
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import subprocess
+from pydantic import BaseModel, Field
+import asyncio
 import os
+import shutil
+from typing import Optional
 from urllib.parse import urlparse
 import re
+import functools
+import mmap
+import tempfile
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
 
-app = FastAPI()
+# Use io_uring for the event loop where available (Linux with uringcore
+# installed); otherwise keep the default loop
+try:
+    import uringcore
+except ImportError:
+    pass
+else:
+    asyncio.set_event_loop_policy(uringcore.EventLoopPolicy())
 
-# Global variable to store the project path
-project_path = ""
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Stop the shared worker processes along with the app
+    if executor is not None:
+        await asyncio.to_thread(executor.shutdown, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Worker processes shared by all requests for scrubbing .ts files, started on
+# first use by get_executor
+executor: Optional[ProcessPoolExecutor] = None
+
+# Cloned projects by job ID, least recently used first
+jobs: "OrderedDict[str, ProjectState]" = OrderedDict()
+
+# Number of cloned projects kept in jobs before the oldest is evicted
+MAX_JOBS = 32
+
+# Directories that are never scanned or rewritten when removing a module:
+# installed dependencies, git metadata, build output and the Angular CLI cache
+SKIPPED_DIRS = {"node_modules", ".git", "dist", ".angular"}
+
+# Opening and closing braces, used to find the end of a route block
+BRACE_RE = re.compile(rb"[{}]")
+
+# Number of .ts files handed to a worker process at a time
+SCRUB_BATCH_SIZE = 64
 
 
 class RepoDetails(BaseModel):
     repo_url: str
     clone_dir: str
     new_name: str  # Allow user to specify new project name
+    # Commits of history to clone; None for full history
+    depth: Optional[int] = Field(1, ge=1)
 
 
 class ModuleToRemove(BaseModel):
+    job_id: str  # Job ID returned by /clone-repo/
     module_name: str  # Allow user to specify the Angular module to remove
 
 
+@dataclass
+class ProjectState:
+    """A cloned project, with its modules and .ts files found at clone time.
+
+    Hold lock while checking, removing and forgetting a module, so concurrent
+    requests for the same project don't scrub files another one is deleting.
+    """
+
+    project_path: str
+    angular_modules: list
+    ts_files: list
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def forget_module(self, module_name: str):
+        """Drops a deleted module and the .ts files that were inside it."""
+        self.angular_modules.remove(module_name)
+        self.ts_files = _without_module_files(
+            self.ts_files, get_module_path(self.project_path, module_name)
+        )
+
+
+def get_module_path(project_path: str, module_name: str) -> str:
+    """Returns the directory of an Angular module inside 'src/app/'."""
+    return os.path.join(project_path, "src", "app", module_name)
+
+
+def _without_module_files(file_paths, angular_module_path: str) -> list:
+    """Returns the file paths that are not inside the module directory."""
+    module_prefix = angular_module_path + os.sep
+    return [path for path in file_paths if not path.startswith(module_prefix)]
+
+
+@functools.lru_cache(maxsize=1024)
 def get_project_name(repo_url: str) -> str:
     """Extracts the project name from the Git repository URL."""
     parsed_url = urlparse(repo_url)
@@ -32,106 +113,241 @@ def get_project_name(repo_url: str) -> str:
 
 def get_angular_modules(project_path: str):
     """Returns Angular modules inside 'src/app/'."""
-    angular_modules = []
-
     # Path for Angular modules
     angular_module_path = os.path.join(project_path, "src", "app")
 
-    if os.path.exists(angular_module_path):
-        # List Angular modules inside 'src/app/'
-        angular_modules = [
-            d
-            for d in os.listdir(angular_module_path)
-            if os.path.isdir(os.path.join(angular_module_path, d))
-        ]
+    try:
+        with os.scandir(angular_module_path) as entries:
+            return [
+                entry.name for entry in entries if entry.is_dir(follow_symlinks=False)
+            ]
+    except FileNotFoundError:
+        return []
+
+
+def iter_ts_files(project_path: str):
+    """Yields the paths of all .ts files in the project, skipping SKIPPED_DIRS."""
+    stack = [project_path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIPPED_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.endswith(".ts") and entry.is_file(
+                    follow_symlinks=False
+                ):
+                    yield entry.path
+
+
+# The compiled patterns are only cached in memory. Persisting them across
+# restarts would gain nothing: a pickled re.Pattern stores just its source and
+# flags and is recompiled when loaded.
+@functools.lru_cache(maxsize=64)
+def get_module_pattern(module_name: str) -> re.Pattern:
+    """Compiles a single bytes pattern matching the module's imports and references.
+
+    The alternatives are tried in order at each position, so the import
+    statement is removed whole before the bare path and NgModule references
+    inside it can match. Every quantifier is followed by a character it can't
+    match, so a failed match only backtracks over its own run once.
+    """
+    name = re.escape(module_name)
+    sources = [
+        # The module import statement
+        rf"import\s+{{[^}}]+}}\s+from\s+['\"]\.\/{name}\/[^'\"]+['\"];",
+        # Any other references to the module
+        rf"['\"]\.\/{name}\/[^'\"]+['\"]",
+        # The module in NgModule imports
+        rf"{name}Module,?",
+    ]
+    combined = "|".join(f"(?:{source})" for source in sources)
+    return re.compile(combined.encode(), re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=64)
+def get_route_pattern(module_name: str) -> re.Pattern:
+    """Compiles a bytes pattern matching the start of the module's route block.
+
+    The match includes the whitespace before the block (only tried where that
+    whitespace starts, so long runs are scanned once) and its opening brace;
+    _cut_route_blocks finds the matching closing brace.
+    """
+    name = re.escape(module_name)
+    source = rf"(?<!\s)\s*{{\s*path:\s*'{name}',\s*loadChildren:\s*\(\)\s*=>"
+    return re.compile(source.encode(), re.IGNORECASE)
+
+
+def _cut_route_blocks(content: bytes, module_name: str) -> bytes:
+    """Removes the module's route blocks, including any braces nested inside them."""
+    route_re = get_route_pattern(module_name)
+    pieces = []
+    pos = 0
+    while match := route_re.search(content, pos):
+        depth = 1
+        for brace in BRACE_RE.finditer(content, match.end()):
+            depth += 1 if brace.group() == b"{" else -1
+            if depth == 0:
+                break
+        else:
+            # Unbalanced block, leave the rest of the file as it is
+            break
+
+        end = brace.end()
+        if content.startswith(b",", end):
+            end += 1
+        pieces.append(content[pos : match.start()])
+        pos = end
+
+    if not pieces:
+        return content
+    pieces.append(content[pos:])
+    return b"".join(pieces)
+
+
+def _scrub(content: bytes, module_name: str) -> bytes:
+    """Removes the module's route blocks, imports and references from content."""
+    content = _cut_route_blocks(content, module_name)
+    return get_module_pattern(module_name).sub(b"", content)
 
-    return angular_modules
 
+@functools.lru_cache(maxsize=64)
+def get_module_needle(module_name: str) -> re.Pattern:
+    """Compiles a case-insensitive bytes pattern for the bare module name."""
+    return re.compile(re.escape(module_name.encode()), re.IGNORECASE)
 
-def remove_angular_module(project_path: str, module_name: str):
-    """Removes the specified Angular module and its dependencies from the project."""
-    angular_module_path = os.path.join(project_path, "src", "app", module_name)
+
+def _write_atomic(file_path: str, data: bytes):
+    """Replaces the file's content via a temp file, so it is never half-written."""
+    tmp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(file_path), delete=False)
+    try:
+        with tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        shutil.copymode(file_path, tmp_file.name)
+        os.replace(tmp_file.name, file_path)
+    except BaseException:
+        os.remove(tmp_file.name)
+        raise
+
+
+def _scrub_file(file_path: str, module_name: str) -> bool:
+    """Removes references to the module from a .ts file; returns True if it changed.
+
+    Runs in worker processes, so the patterns are compiled (and cached) per worker.
+    """
+    try:
+        file = open(file_path, "rb")
+    except FileNotFoundError:
+        # Deleted since the project was scanned, so there is nothing to remove
+        return False
+
+    with file:
+        # mmap can't map empty files, and those have nothing to remove anyway
+        if os.fstat(file.fileno()).st_size == 0:
+            return False
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Skip files that never mention the module without copying them
+            # into memory (the pattern is case-insensitive, so the check is too)
+            if not get_module_needle(module_name).search(mapped):
+                return False
+            content = mapped[:]
+
+    new_content = _scrub(content, module_name)
+
+    # Leave unchanged files alone so their mtimes don't trigger a rebuild in
+    # ng serve. re.sub returns its input object when nothing matched, so the
+    # identity check covers the common case without comparing the bytes.
+    if new_content is content or new_content == content:
+        return False
+
+    _write_atomic(file_path, new_content)
+    return True
+
+
+def _scrub_files(file_paths, module_name: str) -> int:
+    """Runs _scrub_file over a batch of files; returns how many changed."""
+    return sum(_scrub_file(file_path, module_name) for file_path in file_paths)
+
+
+async def remove_angular_module(
+    project_path: str, module_name: str, file_paths: Optional[list] = None
+):
+    """Removes the specified Angular module and its dependencies from the project.
+
+    file_paths are the project's .ts files, scanned from disk if not given.
+    """
+    angular_module_path = get_module_path(project_path, module_name)
 
     # Remove the module directory
     if os.path.exists(angular_module_path):
-        subprocess.run(["rm", "-rf", angular_module_path])
-
-    # Update app-routing.module.ts
-    app_routing_module_path = os.path.join(
-        project_path, "src", "app", "app-routing.module.ts"
-    )
-    if os.path.exists(app_routing_module_path):
-        with open(app_routing_module_path, "r") as file:
-            content = file.read()
-
-        # Remove the module import statement
-        content = re.sub(
-            rf"import\s+{{[^}}]+}}\s+from\s+['\"]\.\/{module_name}\/[^'\"]+['\"];",
-            "",
-            content,
-            flags=re.IGNORECASE,
-        )
+        await asyncio.to_thread(shutil.rmtree, angular_module_path, ignore_errors=True)
+
+    if file_paths is None:
+        file_paths = await asyncio.to_thread(list, iter_ts_files(project_path))
+    file_paths = _without_module_files(file_paths, angular_module_path)
+
+    # Remove references to the module in all .ts files, app-routing.module.ts
+    # included. Files are sent to the workers in batches to amortize IPC, and
+    # the batches' reads and writes overlap across worker processes.
+    batches = [
+        file_paths[i : i + SCRUB_BATCH_SIZE]
+        for i in range(0, len(file_paths), SCRUB_BATCH_SIZE)
+    ]
+    if not batches:
+        return
+    if len(batches) == 1:
+        # Not worth the IPC, scrub the batch in a thread instead
+        await asyncio.to_thread(_scrub_files, batches[0], module_name)
+        return
+
+    pool = get_executor()
+    futures = [pool.submit(_scrub_files, batch, module_name) for batch in batches]
+    waiters = [asyncio.wrap_future(future) for future in futures]
+    try:
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # If a batch failed, drop the ones that haven't started, then wait
+        # (without blocking the loop) for those still running so no file is
+        # written after we return
+        for future in futures:
+            future.cancel()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
 
-        # Remove the module route block
-        content = re.sub(
-            rf"\s*{{\s*path:\s*'{module_name}',\s*loadChildren:\s*\(\)\s*=>\s*[^}}]+}},?",
-            "",
-            content,
-            flags=re.IGNORECASE,
-        )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Returns the shared worker process pool, starting it if needed."""
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor()
+    return executor
+
+
+def get_job(job_id: str) -> ProjectState:
+    """Returns the cloned project for a job ID, marking it as recently used."""
+    if job_id not in jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    jobs.move_to_end(job_id)
+    return jobs[job_id]
 
-        # Remove any other references to the module
-        content = re.sub(
-            rf"['\"]\.\/{module_name}\/[^'\"]+['\"]", "", content, flags=re.IGNORECASE
-        )
 
-        with open(app_routing_module_path, "w") as file:
-            file.write(content)
-
-    # Remove references to the module in all other .ts files
-    for root, _, files in os.walk(project_path):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            if file_path.endswith(".ts"):
-                with open(file_path, "r") as file:
-                    content = file.read()
-
-                # Remove the module import statement
-                content = re.sub(
-                    rf"import\s+{{[^}}]+}}\s+from\s+['\"]\.\/{module_name}\/[^'\"]+['\"];",
-                    "",
-                    content,
-                    flags=re.IGNORECASE,
-                )
-
-                # Remove the module from NgModule imports
-                content = re.sub(
-                    rf"{module_name}Module,?", "", content, flags=re.IGNORECASE
-                )
-
-                # Remove any other references to the module
-                content = re.sub(
-                    rf"['\"]\.\/{module_name}\/[^'\"]+['\"]",
-                    "",
-                    content,
-                    flags=re.IGNORECASE,
-                )
-
-                # Remove the module route block
-                content = re.sub(
-                    rf"\s*{{\s*path:\s*'{module_name}',\s*loadChildren:\s*\(\)\s*=>\s*[^}}]+}},?",
-                    "",
-                    content,
-                    flags=re.IGNORECASE,
-                )
-
-                with open(file_path, "w") as file:
-                    file.write(content)
+def add_job(state: ProjectState) -> str:
+    """Registers a cloned project, evicting the least recently used if full."""
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = state
+    while len(jobs) > MAX_JOBS:
+        jobs.popitem(last=False)
+    return job_id
 
 
 @app.post("/clone-repo/")
 async def clone_repo(repo_details: RepoDetails):
-    global project_path
     try:
         # Ensure the base clone directory exists
         if not os.path.exists(repo_details.clone_dir):
@@ -144,17 +360,27 @@ async def clone_repo(repo_details: RepoDetails):
         original_path = os.path.join(repo_details.clone_dir, original_project_name)
         renamed_path = os.path.join(repo_details.clone_dir, repo_details.new_name)
 
-        # Clone the repository
-        result = subprocess.run(
-            ["git", "clone", repo_details.repo_url, original_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+        # Clone the repository, skipping history that is not needed. A shallow
+        # checkout needs every blob at HEAD anyway, so only full-history
+        # clones defer the older blobs with a blobless filter.
+        clone_args = ["git", "clone"]
+        if repo_details.depth is not None:
+            clone_args += ["--depth", str(repo_details.depth), "--single-branch"]
+        else:
+            clone_args += ["--filter=blob:none"]
+        process = await asyncio.create_subprocess_exec(
+            *clone_args,
+            repo_details.repo_url,
+            original_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
         )
+        stdout, stderr = await process.communicate()
+        stdout, stderr = stdout.decode(), stderr.decode()
 
         # Check for cloning errors
-        if result.returncode != 0:
-            raise HTTPException(status_code=400, detail=result.stderr.strip())
+        if process.returncode != 0:
+            raise HTTPException(status_code=400, detail=stderr.strip())
 
         # Rename the project directory
         if os.path.exists(original_path):
@@ -165,19 +391,21 @@ async def clone_repo(repo_details: RepoDetails):
                 detail="Cloning successful, but project folder not found.",
             )
 
-        # Set the global project path
-        project_path = renamed_path
-
         # Get all available Angular modules
         angular_modules = get_angular_modules(renamed_path)
 
+        # Register the project so later requests don't rescan it
+        ts_files = await asyncio.to_thread(list, iter_ts_files(renamed_path))
+        job_id = add_job(ProjectState(renamed_path, list(angular_modules), ts_files))
+
         return {
             "message": "Repository cloned and renamed successfully",
+            "job_id": job_id,
             "original_project_name": original_project_name,
             "new_project_name": repo_details.new_name,
             "clone_location": renamed_path,
             "angular_modules": angular_modules,
-            "output": (result.stdout + result.stderr).strip() or "No output from git.",
+            "output": (stdout + stderr).strip() or "No output from git.",
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -185,23 +413,38 @@ async def clone_repo(repo_details: RepoDetails):
 
 @app.post("/remove-module/")
 async def remove_module(module_details: ModuleToRemove):
-    global project_path
+    # Get the cloned project and its Angular modules (outside the try, so an
+    # unknown job is reported as a 404)
+    state = get_job(module_details.job_id)
+
     try:
-        # Get all available Angular modules
-        angular_modules = get_angular_modules(project_path)
-
-        # Remove the specified Angular module and its dependencies
-        if module_details.module_name in angular_modules:
-            remove_angular_module(project_path, module_details.module_name)
-            angular_modules.remove(module_details.module_name)
-            return {
-                "message": f"Module '{module_details.module_name}' removed successfully",
-                "remaining_modules": angular_modules,
-            }
-        else:
-            raise HTTPException(status_code=404, detail="Module not found")
+        async with state.lock:
+            # Remove the specified Angular module and its dependencies
+            if module_details.module_name in state.angular_modules:
+                try:
+                    await remove_angular_module(
+                        state.project_path, module_details.module_name, state.ts_files
+                    )
+                finally:
+                    # Once the directory is gone, forget the module even if
+                    # scrubbing the other files failed, so later requests
+                    # don't trip over its deleted files
+                    module_path = get_module_path(
+                        state.project_path, module_details.module_name
+                    )
+                    if not os.path.exists(module_path):
+                        state.forget_module(module_details.module_name)
+                return {
+                    "message": f"Module '{module_details.module_name}' removed successfully",
+                    "remaining_modules": list(state.angular_modules),
+                }
+            else:
+                raise HTTPException(status_code=404, detail="Module not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # To run the FastAPI app, use the command: uvicorn main:app --reload
+# (with uringcore installed, run it from Python instead so the io_uring loop
+# policy is set before uvicorn creates its loop:
+#   python -c "import main, uvicorn; uvicorn.run(main.app, loop='none')")
@@ -0,0 +1,151 @@
+import re
+
+import pytest
+from pydantic import ValidationError
+
+from main import RepoDetails, _scrub, _scrub_file
+
+APP_ROUTING_MODULE = """\
+import { NgModule } from '@angular/core';
+import { RouterModule, Routes } from '@angular/router';
+import { UsersListComponent } from './users/users-list/users-list.component';
+
+const routes: Routes = [
+  { path: '', redirectTo: 'admin', pathMatch: 'full' },
+  {
+    path: 'users',
+    loadChildren: () => import('./users/users.module').then(m => m.UsersModule),
+  },
+  { path: 'admin', loadChildren: () => import('./admin/admin.module').then(m => m.AdminModule) },
+];
+
+@NgModule({
+  imports: [RouterModule.forRoot(routes)],
+  exports: [RouterModule]
+})
+export class AppRoutingModule { }
+"""
+
+APP_MODULE = """\
+import { NgModule } from '@angular/core';
+import { BrowserModule } from '@angular/platform-browser';
+
+import { AppRoutingModule } from './app-routing.module';
+import { AppComponent } from './app.component';
+import { UsersModule } from './users/users.module';
+import { AdminModule } from './admin/admin.module';
+
+@NgModule({
+  declarations: [
+    AppComponent
+  ],
+  imports: [
+    BrowserModule,
+    AppRoutingModule,
+    UsersModule,
+    AdminModule
+  ],
+  providers: [],
+  bootstrap: [AppComponent]
+})
+export class AppModule { }
+"""
+
+LAST_ROUTE_WITHOUT_COMMA = """\
+const routes: Routes = [
+  { path: 'admin', loadChildren: () => import('./admin/admin.module').then(m => m.AdminModule) },
+  { path: 'users', loadChildren: () => import('./users/users.module').then(m => m.UsersModule) }
+];
+"""
+
+NESTED_ROUTE = """\
+const routes: Routes = [
+  { path: 'users', loadChildren: () => import('./users/users.module').then(m => { return m.UsersModule; }) },
+  { path: 'admin', loadChildren: () => import('./admin/admin.module').then(m => m.AdminModule) },
+];
+"""
+
+NESTED_ROUTE_SCRUBBED = """\
+const routes: Routes = [
+  { path: 'admin', loadChildren: () => import('./admin/admin.module').then(m => m.AdminModule) },
+];
+"""
+
+BRACES_IN_STRING_ROUTE = """\
+const routes: Routes = [
+  { path: 'users', loadChildren: () => import('./users/users.module').then(m => m.UsersModule), data: { title: '{users}' } },
+  { path: 'admin', loadChildren: () => import('./admin/admin.module').then(m => m.AdminModule) },
+];
+"""
+
+UNBALANCED_ROUTE = """\
+const routes: Routes = [
+  { path: 'admin', loadChildren: () => import('./admin/admin.module').then(m => m.AdminModule) },
+  { path: 'users', loadChildren: () => { broken
+"""
+
+COMMENT_ONLY = """\
+// The users feature used to be lazy-loaded from here.
+export const environment = { production: false };
+"""
+
+
+def baseline_scrub(content, module_name, routing=False):
+    """The sequential re.sub passes remove_angular_module used to run."""
+    import_src = rf"import\s+{{[^}}]+}}\s+from\s+['\"]\.\/{module_name}\/[^'\"]+['\"];"
+    route_src = rf"\s*{{\s*path:\s*'{module_name}',\s*loadChildren:\s*\(\)\s*=>\s*[^}}]+}},?"
+    ref_src = rf"['\"]\.\/{module_name}\/[^'\"]+['\"]"
+    ngmodule_src = rf"{module_name}Module,?"
+
+    # app-routing.module.ts had its own pass before the walk over all .ts files
+    passes = [import_src, route_src, ref_src] if routing else []
+    passes += [import_src, ngmodule_src, ref_src, route_src]
+    for source in passes:
+        content = re.sub(source, "", content, flags=re.IGNORECASE)
+    return content
+
+
+def assert_scrubbed(tmp_path, content, expected):
+    assert _scrub(content.encode(), "users") == expected.encode()
+
+    file_path = tmp_path / "file.ts"
+    file_path.write_bytes(content.encode())
+    assert _scrub_file(str(file_path), "users") == (expected != content)
+    assert file_path.read_bytes() == expected.encode()
+
+
+@pytest.mark.parametrize(
+    "content, routing",
+    [
+        (APP_ROUTING_MODULE, True),
+        (APP_MODULE, False),
+        (LAST_ROUTE_WITHOUT_COMMA, True),
+    ],
+)
+def test_scrub_matches_baseline(tmp_path, content, routing):
+    expected = baseline_scrub(content, "users", routing)
+    assert expected != content
+    assert_scrubbed(tmp_path, content, expected)
+
+
+def test_scrub_leaves_comment_only_mention(tmp_path):
+    assert_scrubbed(tmp_path, COMMENT_ONLY, COMMENT_ONLY)
+
+
+@pytest.mark.parametrize("content", [NESTED_ROUTE, BRACES_IN_STRING_ROUTE])
+def test_scrub_cuts_whole_route_block(tmp_path, content):
+    # The old [^}]+ route pattern stopped at the first nested '}'
+    assert_scrubbed(tmp_path, content, NESTED_ROUTE_SCRUBBED)
+
+
+def test_scrub_leaves_unbalanced_route_block(tmp_path):
+    assert_scrubbed(tmp_path, UNBALANCED_ROUTE, UNBALANCED_ROUTE)
+
+
+def test_repo_details_depth():
+    repo = {"repo_url": "https://example.com/app.git", "clone_dir": "/tmp", "new_name": "app"}
+    assert RepoDetails(**repo).depth == 1
+    assert RepoDetails(**repo, depth=None).depth is None
+    for depth in (0, -1):
+        with pytest.raises(ValidationError):
+            RepoDetails(**repo, depth=depth)